@@ -1,77 +1,447 @@
 from flask import Flask, request, jsonify
 import cv2
 import numpy as np
+import orjson
 import os
-from datetime import datetime
+import sys
+import atexit
+import logging
+import logging.handlers
+import queue
+import struct
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from colorama import Fore, Back, Style, init
 
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+try:
+    from waitress import serve
+except ImportError:
+    serve = None
+
 # Initialize colorama
 init(autoreset=True)
 
+# Per-marker details are only logged in verbose mode to keep the hot path lean
+VERBOSE = os.environ.get('ARUCOPY_VERBOSE', '0') == '1'
+
+SUCCESS = 25
+logging.addLevelName(SUCCESS, 'SUCCESS')
+
+class ColorFormatter(logging.Formatter):
+    """Wrap each formatted record in the colorama color for its level"""
+    LEVEL_COLORS = {
+        logging.DEBUG: Fore.BLUE,
+        logging.INFO: Fore.CYAN,
+        SUCCESS: Fore.GREEN,
+        logging.WARNING: Fore.YELLOW,
+        logging.ERROR: Fore.RED,
+    }
+    
+    cached_second = None
+    cached_time = None
+    
+    def format(self, record):
+        color = self.LEVEL_COLORS.get(record.levelno, '')
+        return f"{color}{super().format(record)}{Style.RESET_ALL}"
+    
+    def formatTime(self, record, datefmt=None):
+        # The date format has one-second resolution, so records logged within
+        # the same second share a single strftime result
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_time = super().formatTime(record, datefmt)
+            self.cached_second = second
+        return self.cached_time
+
+logger = logging.getLogger('arucopy')
+logger.setLevel(logging.DEBUG if VERBOSE else logging.INFO)
+logger.propagate = False
+
+# Request threads only enqueue records; a single listener thread formats
+# timestamps and colors and is the only one touching stdout
+log_handler = logging.StreamHandler(sys.stdout)
+log_handler.setFormatter(ColorFormatter('[%(levelname)s] %(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 app = Flask(__name__)
 
+# One OpenCV thread per request thread avoids oversubscribing cores under the
+# threaded server; single-process deployments can raise it via ARUCOPY_CV_THREADS.
+# OpenCL probing is disabled so the first request doesn't pay for it.
+cv2.setNumThreads(int(os.environ.get('ARUCOPY_CV_THREADS', '1')))
+cv2.ocl.setUseOpenCL(False)
+cv2.setUseOptimized(True)
+
 # Initialize ArUco dictionary and parameters
 ARUCO_DICT = cv2.aruco.DICT_4X4_50
 aruco_dictionary = cv2.aruco.getPredefinedDictionary(ARUCO_DICT)
 aruco_parameters = cv2.aruco.DetectorParameters()
+
+# ArUco3 detection searches for candidates on a downscaled image sized from the
+# smallest marker we expect, trading tiny-marker recall for near-linear speedup
+aruco_parameters.useAruco3Detection = os.environ.get('ARUCOPY_USE_ARUCO3', '1') == '1'
+aruco_parameters.minMarkerLengthRatioOriginalImg = float(os.environ.get('ARUCOPY_MIN_MARKER_RATIO', '0.05'))
+aruco_parameters.minSideLengthCanonicalImg = int(os.environ.get('ARUCOPY_MIN_SIDE_CANONICAL', '32'))
+
+# A single adaptive threshold window instead of the default 3-pass sweep (3, 13, 23)
+ADAPTIVE_THRESH_WIN_SIZE = int(os.environ.get('ARUCOPY_THRESH_WIN_SIZE', '13'))
+aruco_parameters.adaptiveThreshWinSizeMin = ADAPTIVE_THRESH_WIN_SIZE
+aruco_parameters.adaptiveThreshWinSizeMax = ADAPTIVE_THRESH_WIN_SIZE
+aruco_parameters.adaptiveThreshWinSizeStep = 10
+
+# Sub-pixel corner refinement only pays off when corners feed pose estimation
+if os.environ.get('ARUCOPY_SUBPIX_CORNERS', '0') == '1':
+    aruco_parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+else:
+    aruco_parameters.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_NONE
 detector = cv2.aruco.ArucoDetector(aruco_dictionary, aruco_parameters)
 
+# Cheap threshold + contour pass that skips the full detector on frames with no
+# quads. Off by default: it only pays off on feeds that are mostly marker-free,
+# so check its recall against detectMarkers on your own frames before enabling
+USE_PREFILTER = os.environ.get('ARUCOPY_PREFILTER', '0') == '1'
+MIN_CANDIDATE_AREA = float(os.environ.get('ARUCOPY_MIN_CANDIDATE_AREA', '100'))
+
+# Optional request batching: concurrent same-shape frames arriving within the
+# window are tiled into one image and detected with a single call. Disabled
+# by default (0 ms) since it adds latency for solitary callers.
+BATCH_WINDOW_MS = float(os.environ.get('ARUCOPY_BATCH_WINDOW_MS', '0'))
+BATCH_ROWS = 2
+BATCH_COLS = 4
+BATCH_GUTTER = 16  # White gap between tiles so markers never touch across frames
+
 # Create logs directory if it doesn't exist
 LOGS_DIR = './logs'
 if not os.path.exists(LOGS_DIR):
     os.makedirs(LOGS_DIR)
     print(f"{Fore.GREEN}[INFO] Created logs directory: {LOGS_DIR}")
 
+# Annotated log images are encoded and written off the request thread;
+# cv2.imwrite releases the GIL so a couple of workers are enough
+save_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='arucopy-save')
+# Each pending save holds a full decoded frame, so cap in-flight saves and
+# skip the log image when the workers fall behind
+MAX_PENDING_SAVES = int(os.environ.get('ARUCOPY_MAX_PENDING_SAVES', '4'))
+save_slots = threading.BoundedSemaphore(MAX_PENDING_SAVES)
+
+# Log image format: jpg (default), webp, png, or none to skip writing images
+LOG_IMAGE_FORMATS = {
+    'jpg': [int(cv2.IMWRITE_JPEG_QUALITY), 85],
+    'webp': [int(cv2.IMWRITE_WEBP_QUALITY), 85],
+    'png': [],
+    'none': None,
+}
+LOG_IMAGE_FORMAT = os.environ.get('ARUCOPY_LOG_IMG_FORMAT', 'jpg').lower()
+if LOG_IMAGE_FORMAT not in LOG_IMAGE_FORMATS:
+    LOG_IMAGE_FORMAT = 'jpg'
+LOG_IMAGE_PARAMS = LOG_IMAGE_FORMATS[LOG_IMAGE_FORMAT]
+
+# JPEG files start with the SOI marker followed by another marker prefix
+JPEG_MAGIC = b'\xff\xd8\xff'
+# JPEG 2000 as a JP2 container or a raw codestream
+JP2_MAGICS = (b'\x00\x00\x00\x0cjP  \r\n\x87\n', b'\xff\x4f\xff\x51')
+
+# GPU decoding is opt-in since it needs CUDA and nvImageCodec on the host
+USE_NVJPEG = os.environ.get('ARUCOPY_USE_NVJPEG', '0') == '1'
+
+def log_debug(message):
+    logger.debug(message)
+
 def log_info(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"{Fore.CYAN}[INFO] {timestamp} - {message}{Style.RESET_ALL}")
+    logger.info(message)
 
 def log_success(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"{Fore.GREEN}[SUCCESS] {timestamp} - {message}{Style.RESET_ALL}")
+    logger.log(SUCCESS, message)
 
 def log_warning(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"{Fore.YELLOW}[WARNING] {timestamp} - {message}{Style.RESET_ALL}")
+    logger.warning(message)
 
 def log_error(message):
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"{Fore.RED}[ERROR] {timestamp} - {message}{Style.RESET_ALL}")
+    logger.error(message)
+
+nvjpeg_decoder = None
+nvjpeg_params = None
+if USE_NVJPEG:
+    try:
+        from nvidia import nvimgcodec
+        nvjpeg_decoder = nvimgcodec.Decoder()
+        nvjpeg_params = nvimgcodec.DecodeParams(color_spec=nvimgcodec.ColorSpec.GRAY)
+        log_success("nvJPEG decoder initialized")
+    except Exception as e:
+        log_warning(f"nvJPEG unavailable, using CPU decoding: {str(e)}")
+
+# Per-thread scratch buffers reused across same-shape frames so pages stay hot
+thread_buffers = threading.local()
+
+def get_thread_buffer(name, shape):
+    """Return a thread-local uint8 buffer of the given shape, reallocating on shape change"""
+    buffer = getattr(thread_buffers, name, None)
+    if buffer is None or buffer.shape != shape:
+        buffer = np.empty(shape, np.uint8)
+        setattr(thread_buffers, name, buffer)
+    return buffer
+
+def read_upload_buffer(file):
+    """Wrap the uploaded file contents in a uint8 array, avoiding a copy when possible"""
+    stream = file.stream
+    # Small uploads are spooled in a BytesIO whose buffer can be viewed in place
+    if hasattr(stream, 'getbuffer'):
+        return np.frombuffer(stream.getbuffer(), np.uint8)
+    return np.frombuffer(stream.read(), np.uint8)
+
+def decode_grayscale_gpu(file_bytes):
+    """Decode JPEG/JPEG 2000 bytes to grayscale on the GPU, None if not possible"""
+    if nvjpeg_decoder is None:
+        return None
+    header = file_bytes[:12].tobytes()
+    if not (header[:3] == JPEG_MAGIC or header.startswith(JP2_MAGICS)):
+        return None
+    
+    try:
+        decoded = nvjpeg_decoder.decode(file_bytes, params=nvjpeg_params)
+        if decoded is None:
+            return None
+        gray = np.asarray(decoded.cpu())
+        return gray[:, :, 0] if gray.ndim == 3 else gray
+    except Exception as e:
+        log_warning(f"nvJPEG could not decode image, falling back to CPU: {str(e)}")
+        return None
+
+def jpeg_is_upright(file_bytes):
+    """Return True if a JPEG has no EXIF orientation or orientation 1 (False if unsure)"""
+    data = memoryview(file_bytes)
+    try:
+        offset = 2  # Skip SOI
+        while offset + 4 <= len(data):
+            if data[offset] != 0xFF:
+                return False
+            marker = data[offset + 1]
+            if marker == 0xFF:
+                offset += 1  # Fill byte
+                continue
+            if marker in (0xD9, 0xDA):
+                return True  # Image data starts - no EXIF segment before it
+            length = struct.unpack_from('>H', data, offset + 2)[0]
+            if marker == 0xE1 and data[offset + 4:offset + 10] == b'Exif\x00\x00':
+                # TIFF header, then IFD0 entries of 12 bytes: tag, type, count, value
+                tiff = offset + 10
+                order = '<' if data[tiff:tiff + 2] == b'II' else '>'
+                ifd = tiff + struct.unpack_from(order + 'I', data, tiff + 4)[0]
+                for entry in range(ifd + 2, ifd + 2 + 12 * struct.unpack_from(order + 'H', data, ifd)[0], 12):
+                    if struct.unpack_from(order + 'H', data, entry)[0] == 0x0112:
+                        return struct.unpack_from(order + 'H', data, entry + 8)[0] == 1
+                return True
+            offset += 2 + length
+    except (struct.error, IndexError, ValueError):
+        pass
+    return False
 
-def save_detection_image(image, corners, ids):
-    """Draw markers on image and save to logs directory"""
+def decode_grayscale(file_bytes):
+    """Decode uploaded image bytes straight to a single-channel image for the detector"""
+    gray = decode_grayscale_gpu(file_bytes)
+    if gray is not None:
+        return gray
+    
+    # libjpeg-turbo can emit luma directly, skipping the BGR buffer and cvtColor pass.
+    # It ignores EXIF orientation, so rotated JPEGs go to OpenCV, which applies it
+    if simplejpeg is not None and file_bytes[:3].tobytes() == JPEG_MAGIC and jpeg_is_upright(file_bytes):
+        try:
+            height, width = simplejpeg.decode_jpeg_header(file_bytes)[:2]
+            gray_buffer = get_thread_buffer('gray', (height, width, 1))
+            return simplejpeg.decode_jpeg(file_bytes, colorspace='GRAY', buffer=gray_buffer)[:, :, 0]
+        except ValueError as e:
+            log_warning(f"simplejpeg could not decode image, falling back to OpenCV: {str(e)}")
+    
+    # OpenCV can also decode to one channel, avoiding the BGR buffer and cvtColor pass
+    return cv2.imdecode(file_bytes, cv2.IMREAD_GRAYSCALE)
+
+def has_candidate(gray):
+    """Return True if the frame contains at least one quadrilateral that could be a marker"""
+    # Same adaptive threshold as the detector (a global threshold misses markers
+    # under uneven lighting); inverted so the dark marker borders are foreground.
+    # adaptiveThreshold needs an odd block size; the detector rounds even ones up too
+    binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV,
+                                   ADAPTIVE_THRESH_WIN_SIZE | 1, aruco_parameters.adaptiveThreshConstant)
+    # RETR_LIST also yields the inner border of markers touching other dark regions
+    contours, _ = cv2.findContours(binary, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    
+    for contour in contours:
+        if cv2.contourArea(contour) < MIN_CANDIDATE_AREA:
+            continue
+        approx = cv2.approxPolyDP(contour, 0.05 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            return True
+    return False
+
+class DetectionBatcher:
+    """Collate concurrent detection requests into tiled detectMarkers calls"""
+    
+    def __init__(self, window_ms):
+        self.window = window_ms / 1000.0
+        self.max_frames = BATCH_ROWS * BATCH_COLS
+        self.requests = queue.Queue()
+        
+        # ArUco3's minimum marker ratio is relative to the whole input, so scale
+        # it down to keep the same absolute minimum size inside each tile
+        batch_parameters = detector.getDetectorParameters()
+        batch_parameters.minMarkerLengthRatioOriginalImg /= BATCH_COLS
+        self.detector = cv2.aruco.ArucoDetector(aruco_dictionary, batch_parameters)
+        
+        self.worker = threading.Thread(target=self.run, name='arucopy-batch', daemon=True)
+        self.worker.start()
+    
+    def detect(self, gray):
+        """Queue a grayscale frame and block until its (corners, ids) are ready"""
+        future = Future()
+        self.requests.put((gray, future))
+        return future.result()
+    
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_frames:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Only frames of the same shape can share a tile grid
+            by_shape = {}
+            for gray, future in batch:
+                by_shape.setdefault(gray.shape, []).append((gray, future))
+            for group in by_shape.values():
+                try:
+                    self.detect_group(group)
+                except Exception as e:
+                    for _, future in group:
+                        if not future.done():
+                            future.set_exception(e)
+    
+    def detect_group(self, group):
+        if len(group) == 1:
+            gray, future = group[0]
+            corners, ids, _ = detector.detectMarkers(gray)
+            future.set_result((corners, ids))
+            return
+        
+        height, width = group[0][0].shape
+        cell_height = height + BATCH_GUTTER
+        cell_width = width + BATCH_GUTTER
+        rows = (len(group) + BATCH_COLS - 1) // BATCH_COLS
+        cols = min(len(group), BATCH_COLS)
+        
+        tile = np.full((rows * cell_height - BATCH_GUTTER, cols * cell_width - BATCH_GUTTER), 255, np.uint8)
+        for index, (gray, _) in enumerate(group):
+            y0 = (index // BATCH_COLS) * cell_height
+            x0 = (index % BATCH_COLS) * cell_width
+            tile[y0:y0 + height, x0:x0 + width] = gray
+        
+        corners, ids, _ = self.detector.detectMarkers(tile)
+        
+        # Demux markers back to their source frame by the cell holding their center
+        frame_corners = [[] for _ in group]
+        frame_ids = [[] for _ in group]
+        if ids is not None:
+            for marker_corners, marker_id in zip(corners, ids.ravel().tolist()):
+                center_x, center_y = marker_corners[0].mean(axis=0)
+                row = min(int(center_y // cell_height), rows - 1)
+                col = min(int(center_x // cell_width), cols - 1)
+                index = row * BATCH_COLS + col
+                if index >= len(group):
+                    continue
+                offset = np.array([col * cell_width, row * cell_height], np.float32)
+                frame_corners[index].append(marker_corners - offset)
+                frame_ids[index].append(marker_id)
+        
+        for index, (_, future) in enumerate(group):
+            if frame_ids[index]:
+                future.set_result((tuple(frame_corners[index]), np.array(frame_ids[index], np.int32).reshape(-1, 1)))
+            else:
+                future.set_result(((), None))
+
+batcher = DetectionBatcher(BATCH_WINDOW_MS) if BATCH_WINDOW_MS > 0 else None
+
+def json_response(payload, status=200):
+    """Serialize a response with orjson, which encodes numpy arrays natively"""
+    body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def detection_image_filename():
+    """Generate a timestamped filename for an annotated detection image"""
+    # Nanosecond epoch timestamps sort in capture order without building a datetime
+    return f"detection_{time.time_ns()}.{LOG_IMAGE_FORMAT}"
+
+def save_detection_image(image, corners, ids, filename):
+    """Draw markers on image and save to logs directory (runs on save_executor, takes ownership of image and a save slot)"""
     try:
-        # Create a copy of the image to draw on
-        output_image = image.copy()
+        # The caller hands over ownership of image, so draw on it in place
+        output_image = image
         
         # Draw detected markers
         if ids is not None and len(ids) > 0:
             cv2.aruco.drawDetectedMarkers(output_image, corners, ids)
             
-            # Draw additional info for each marker
-            for i, marker_id in enumerate(ids):
-                # Get corner coordinates
-                corner = corners[i][0]
-                top_left = tuple(corner[0].astype(int))
-                
-                # Put marker ID text
-                cv2.putText(output_image, f"ID: {marker_id[0]}", 
-                           (top_left[0], top_left[1] - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        
-        # Generate filename with timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-        filename = f"detection_{timestamp}.png"
+            # Top-left corner of every marker in one conversion
+            top_lefts = np.asarray(corners)[:, 0, 0, :].astype(np.int32).tolist()
+            
+            # Put marker ID text; a thin non-antialiased stroke keeps raster cost low
+            for (x, y), marker_id in zip(top_lefts, ids.ravel().tolist()):
+                cv2.putText(output_image, f"ID: {marker_id}", (x, y - 10),
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_8)
+        
         filepath = os.path.join(LOGS_DIR, filename)
         
-        # Save image
-        cv2.imwrite(filepath, output_image)
+        # Save image; JPEG/WebP are far cheaper to encode than PNG for camera frames
+        cv2.imwrite(filepath, output_image, LOG_IMAGE_PARAMS)
         log_success(f"Detection image saved: {filename}")
         
         return filename
     except Exception as e:
         log_error(f"Failed to save detection image: {str(e)}")
         return None
+    finally:
+        save_slots.release()
+
+def warmup():
+    """Prime detector scratch buffers and codec libraries before the first request"""
+    shape_env = os.environ.get('ARUCOPY_WARMUP_SHAPE', '1080,1920')
+    if not shape_env:
+        return
+    
+    try:
+        height, width = (int(v) for v in shape_env.split(','))
+        detector.detectMarkers(np.zeros((height, width), np.uint8))
+        
+        # Round-trip a tiny frame through the JPEG encoder, decoders and imwrite
+        ok, encoded = cv2.imencode('.jpg', np.zeros((16, 16, 3), np.uint8))
+        if ok:
+            decode_grayscale(encoded.ravel())
+            cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if LOG_IMAGE_PARAMS is not None:
+                warmup_path = os.path.join(temp_dir, f"warmup.{LOG_IMAGE_FORMAT}")
+                cv2.imwrite(warmup_path, np.zeros((16, 16, 3), np.uint8), LOG_IMAGE_PARAMS)
+        
+        log_info(f"Detector warmed up for {width}x{height} frames")
+    except Exception as e:
+        log_warning(f"Warmup failed: {str(e)}")
+
+warmup()
 
 @app.route('/detect', methods=['POST'])
 def detect_aruco():
@@ -86,22 +456,24 @@ def detect_aruco():
         file = request.files['image']
         log_info(f"Processing image: {file.filename}")
         
-        # Read image file
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        # Read image file and decode to grayscale for detection
+        file_bytes = read_upload_buffer(file)
+        gray = decode_grayscale(file_bytes)
         
-        if image is None:
+        if gray is None:
             log_error("Invalid image file - could not decode")
             return jsonify({'error': 'Invalid image file'}), 400
         
-        log_info(f"Image loaded: {image.shape[1]}x{image.shape[0]} pixels")
-        
-        # Convert to grayscale for detection
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        log_info(f"Image loaded: {gray.shape[1]}x{gray.shape[0]} pixels")
         
         # Detect ArUco markers
         log_info("Detecting ArUco markers...")
-        corners, ids, rejected = detector.detectMarkers(gray)
+        if USE_PREFILTER and not has_candidate(gray):
+            corners, ids = (), None
+        elif batcher is not None:
+            corners, ids = batcher.detect(gray)
+        else:
+            corners, ids, rejected = detector.detectMarkers(gray)
         
         # Prepare response
         result = {
@@ -113,25 +485,43 @@ def detect_aruco():
             result['markers_detected'] = len(ids)
             log_success(f"Detected {len(ids)} ArUco marker(s)")
             
-            for i, marker_id in enumerate(ids):
-                marker_corners = corners[i][0].tolist()
-                result['markers'].append({
-                    'id': int(marker_id[0]),
-                    'corners': marker_corners
-                })
-                log_info(f"  - Marker ID {marker_id[0]} at corners: {[f'({c[0]:.1f},{c[1]:.1f})' for c in marker_corners]}")
+            # Convert ids once and stack corners into one (N, 4, 2) float32 array;
+            # orjson serializes each per-marker view directly
+            marker_ids = ids.ravel().tolist()
+            corners_array = np.asarray(corners).reshape(len(marker_ids), 4, 2)
+            result['markers'] = [
+                {'id': marker_id, 'corners': marker_corners}
+                for marker_id, marker_corners in zip(marker_ids, corners_array)
+            ]
+            
+            if logger.isEnabledFor(logging.DEBUG):
+                for marker in result['markers']:
+                    log_debug(f"  - Marker ID {marker['id']} at corners: {[f'({c[0]:.1f},{c[1]:.1f})' for c in marker['corners']]}")
         else:
             log_warning("No ArUco markers detected in image")
         
         # Check if logging is enabled via query parameter
         log_param = request.args.get('log', 'false').lower()
-        if log_param == 'true':
+        if log_param == 'true' and LOG_IMAGE_PARAMS is None:
+            log_info("Logging enabled - image saving disabled by ARUCOPY_LOG_IMG_FORMAT=none")
+        elif log_param == 'true':
             log_info("Logging enabled - saving detection image")
-            saved_filename = save_detection_image(image, corners, ids)
-            if saved_filename:
-                result['saved_image'] = saved_filename
+            if not save_slots.acquire(blocking=False):
+                log_warning("Too many detection images pending - skipping save")
+            else:
+                # The color image is only needed for the annotated log artifact
+                image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+                if image is None:
+                    save_slots.release()
+                else:
+                    # The filename is reported up front; the worker logs if the write fails
+                    # and releases the slot. image is not touched again here, so the
+                    # worker may draw on it directly
+                    saved_filename = detection_image_filename()
+                    save_executor.submit(save_detection_image, image, corners, ids, saved_filename)
+                    result['saved_image'] = saved_filename
         
-        return jsonify(result), 200
+        return json_response(result)
         
     except Exception as e:
         log_error(f"Exception occurred: {str(e)}")
@@ -154,4 +544,12 @@ if __name__ == '__main__':
     log_info(f"Logs directory: {os.path.abspath(LOGS_DIR)}")
     print(f"{Fore.MAGENTA}{'=' * 50}{Style.RESET_ALL}\n")
     
-    app.run(host='0.0.0.0', port=25660, debug=False)
\ No newline at end of file
+    # Decoding, detection and imwrite all release the GIL, so a threaded
+    # WSGI server scales the detect path across cores
+    server_threads = int(os.environ.get('ARUCOPY_THREADS', str(os.cpu_count() or 4)))
+    if serve is not None:
+        log_info(f"Serving with waitress using {server_threads} threads")
+        serve(app, host='0.0.0.0', port=25660, threads=server_threads)
+    else:
+        log_warning("waitress not installed - falling back to the threaded Flask development server")
+        app.run(host='0.0.0.0', port=25660, debug=False, threaded=True)
\ No newline at end of file
@@ -6,17 +6,31 @@ Line Following Robot with Obstacle Detection
 - Stops when obstacle detected, continues when clear
 
 Runs headless without web interface for maximum performance.
-Uses multithreading to keep line detection and distance sensing separate.
+Line detection runs pinned to its own core while a capture thread keeps the
+newest camera frame ready; obstacle changes arrive as gpiozero
+DistanceSensor callbacks and the main thread just waits for a shutdown
+signal.
 """
 
 import cv2
+import ctypes
+import mmap
 import numpy as np
+import os
 import time
 import threading
 import signal
-import sys
-import subprocess
-from gpiozero import DigitalOutputDevice, DigitalInputDevice
+import lgpio
+from gpiozero import DistanceSensor
+
+try:
+    from numba import njit
+except ImportError:
+    # Without numba the control decision simply runs as plain Python
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
 
 # === MOTOR CONFIGURATION ===
 # Back Left Motor (Motor 1)
@@ -35,12 +49,52 @@ FL_IN2 = 6
 BR_IN1 = 13
 BR_IN2 = 21
 
+# All motor control pins
+MOTOR_PINS = [FL_IN1, FL_IN2, FR_IN1, FR_IN2, BL_IN1, BL_IN2, BR_IN1, BR_IN2]
+
+# GPIO chip that exposes the header pins
+GPIO_CHIP = 0
+
+# On BCM2835..2711 boards (Pi 4 and earlier) motor writes can go straight to
+# the GPIO set/clear registers through /dev/gpiomem, skipping the syscall.
+# lgpio still claims the pins and is used on other SoCs such as the Pi 5's RP1
+USE_GPIOMEM = True
+GPIOMEM_PATH = "/dev/gpiomem"
+GPIOMEM_SOCS = (b"brcm,bcm2711", b"brcm,bcm2837", b"brcm,bcm2836", b"brcm,bcm2835")
+GPSET0 = 0x1C // 4  # Word offsets of the set/clear registers for GPIO 0-31
+GPCLR0 = 0x28 // 4
+
+def motor_bits(*high_pins):
+    """Build a motor group bitmask (bit i = MOTOR_PINS[i]) with the given pins high"""
+    bits = 0
+    for pin in high_pins:
+        bits |= 1 << MOTOR_PINS.index(pin)
+    return bits
+
+# Precomputed pin levels for every motor state, written to all 8 pins at once
+MOTOR_MASK_ALL = (1 << len(MOTOR_PINS)) - 1
+MOTOR_FORWARD = motor_bits(FL_IN2, FR_IN2, BL_IN2, BR_IN2)
+MOTOR_BACKWARD = motor_bits(FL_IN1, FR_IN1, BL_IN1, BR_IN1)
+MOTOR_TURN_LEFT = motor_bits(FL_IN1, BL_IN1, FR_IN2, BR_IN2)
+MOTOR_TURN_RIGHT = motor_bits(FL_IN2, BL_IN2, FR_IN1, BR_IN1)
+MOTOR_LEFT_FORWARD = motor_bits(FR_IN2, BR_IN2)
+MOTOR_RIGHT_FORWARD = motor_bits(FL_IN2, BL_IN2)
+MOTOR_SEARCH_RIGHT = motor_bits(FR_IN2, BR_IN2)  # Scan: only right motors powered
+MOTOR_SEARCH_LEFT = motor_bits(FL_IN2, BL_IN2)   # Scan: only left motors powered
+MOTOR_STOPPED = 0
+
+# BCM register mask for every motor group value (bit i -> 1 << MOTOR_PINS[i])
+GPIO_REGISTER_MASKS = [sum(1 << pin for i, pin in enumerate(MOTOR_PINS) if value >> i & 1)
+                       for value in range(MOTOR_MASK_ALL + 1)]
+
 # === ULTRASONIC SENSOR CONFIGURATION ===
 FRONT_TRIG_PIN = 15
 FRONT_ECHO_PIN = 14
 REAR_TRIG_PIN = 23  # Change to actual rear sensor pins if needed
 REAR_ECHO_PIN = 24  # Change to actual rear sensor pins if needed
 OBSTACLE_DISTANCE = 15.0  # Distance in cm to consider an obstacle
+SENSOR_MAX_DISTANCE = 2.0  # Maximum range in meters reported by the sensors
+SENSOR_QUEUE_LEN = 3       # Readings gpiozero averages; kept short for responsiveness
 
 # === LINE DETECTION PARAMETERS ===
 # PID parameters for line following - reduced for smoother control
@@ -51,10 +105,35 @@ Kd = 0.05  # Derivative gain (reduced to smooth movements)
 # Camera parameters
 CAMERA_WIDTH = 320  # Lower resolution for faster processing
 CAMERA_HEIGHT = 240
+CAMERA_FPS = 30
+FRAME_CENTER = CAMERA_WIDTH // 2  # Column the line should be centered on
+# Only the bottom rows of the frame (closest to the robot) feed the line centroid
+LINE_BAND_ROWS = 80
+LINE_BAND = slice(-LINE_BAND_ROWS, None)  # Built once instead of per frame
+# Luma below this counts as part of the dark line
+LINE_DARK_THRESHOLD = 80
+# Fewer dark pixels than this in the band count as no line
+MIN_LINE_PIXELS = 50
+CAMERA_BUFFERS = 1    # Requested driver queue depth, so frames are never old
+FRAME_WAIT_TIMEOUT = 0.5  # Longest the line loop waits for a new frame
+
+# Reused threshold output for the band, sized once for the configured resolution
+_dark_mask = np.empty((LINE_BAND_ROWS, CAMERA_WIDTH), dtype=np.uint8)
+# Column indices used to weight the column profile for the centroid
+COLUMN_INDEX = np.arange(CAMERA_WIDTH, dtype=np.int32)
+# Line position smoothing: EMA weight of the new reading in 1/256 steps
+LINE_EMA_ALPHA = 230       # ~0.9 - small moves are mostly trusted
+LINE_EMA_ALPHA_JUMP = 128  # 0.5 - jumps over LINE_JUMP_PIXELS go halfway
+LINE_JUMP_PIXELS = 100
 
 # === PROGRAM CONTROL ===
 running = True
-obstacle_detected = False
+# Set by the sensor callbacks while an obstacle is in range; the line loop
+# only checks is_set(), so it never contends for distance_lock
+obstacle_event = threading.Event()
+# Set by signal_handler; the main thread blocks on it instead of polling
+shutdown_event = threading.Event()
+
 moving_backward = False
 front_distance = 100.0
 rear_distance = 100.0
@@ -68,24 +147,63 @@ line_memory_timeout = 3.0  # Increased to 3 seconds for much better recovery
 line_lost_counter = 0      # Counter for consecutive frames with lost line
 max_line_lost_count = 20   # Increased count before search pattern
 last_direction = "forward" # Track last direction to help with recovery
+search_started = None      # When the current slow scan began (None when not scanning)
+search_phase = -1          # Current scan direction: 0 right, 1 left, -1 not scanning
+search_phase_time = 1.0    # Seconds before the scan switches direction
 
 
 # Logging control
 last_log_time = {}  # For throttling repeated log messages
 min_log_interval = 2.0  # Minimum seconds between identical log messages
 
+# Loop pacing
+# Target iteration time per motor state:
+# - Longer delay when going straight (let it move forward)
+# - Shorter delay during sharp turns (more responsive corrections)
+DELAY_BY_STATE = {
+    "forward": 0.08,
+    "left": 0.03,
+    "right": 0.03,
+}
+DEFAULT_LOOP_DELAY = 0.05  # Medium delay for other states
+BRIEF_LOSS_DELAY = 0.05    # Loop delay while coasting through a brief line loss
+MIN_LOOP_PAUSE = 0.01      # Shortest pause between line detection iterations
+SLEEP_SPIN_MARGIN = 0.002  # Final stretch of a wait that is spun instead of slept
+
+# === THREADS ===
+line_thread = None
+# Core and SCHED_FIFO priority for the line detection thread. Keep the priority
+# well below 99 so kernel RT threads still preempt us; adding isolcpus=2 to
+# /boot/firmware/cmdline.txt keeps other tasks off the core as well
+LINE_THREAD_CPU = 2
+LINE_THREAD_PRIORITY = 50
+
+# === CAMERA FRAME BUFFERS ===
+# Triple buffer between the capture thread and the line loop: the capture
+# thread decodes into the back slot and swaps it with the ready slot, and the
+# line loop swaps the ready slot into front. Only slot indices change under
+# frame_cond, so no frame is copied or overwritten while it is being processed
+frame_slots = [None, None, None]
+frame_back, frame_ready, frame_front = 0, 1, 2
+frame_seq = 0  # Bumped for every published frame
+frame_cond = threading.Condition()
+
 # === ULTRASONIC SENSOR OBJECTS ===
-front_trigger = None
-front_echo = None
-rear_trigger = None
-rear_echo = None
+front_sensor = None
+rear_sensor = None
 
 # === THREADING LOCKS ===
 distance_lock = threading.Lock()
-camera_lock = threading.Lock()
-motor_lock = threading.Lock()
 log_lock = threading.Lock()
 
+# === GPIO HANDLE ===
+# One persistent chip handle with the motor pins claimed as a single output
+# group (opened in setup_gpio), so a whole motor state is one ioctl
+gpio_handle = None
+# Mapped GPIO register block (ctypes uint32 array) when /dev/gpiomem is in use
+gpio_mem = None
+gpio_regs = None
+
 def log_message(message, msg_type="INFO", throttle_key=None):
     """Log a message with timestamp and type, with optional throttling"""
     global last_log_time
@@ -103,102 +221,152 @@ def log_message(message, msg_type="INFO", throttle_key=None):
     timestamp = time.strftime("%H:%M:%S", time.localtime())
     print(f"[{timestamp}] {msg_type}: {message}")
 
-# Helper function to set pin state using pinctrl
-def set_pin(pin, value):
+def sleep_until(deadline):
+    """
+    Wait until a time.monotonic() deadline with sub-millisecond accuracy.
+    
+    time.sleep() alone overshoots short delays by several milliseconds, so it
+    only covers the wait up to SLEEP_SPIN_MARGIN before the deadline and the
+    rest is spun on the clock.
+    """
+    remaining = deadline - time.monotonic() - SLEEP_SPIN_MARGIN
+    if remaining > 0:
+        time.sleep(remaining)
+    while time.monotonic() < deadline:
+        pass
+
+def set_realtime(cpu, priority):
+    """Pin the calling thread to one CPU and run it under SCHED_FIFO"""
+    # With pid 0 both calls apply to the calling thread only on Linux
+    try:
+        os.sched_setaffinity(0, {cpu})
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        log_message(f"Thread pinned to CPU {cpu} with SCHED_FIFO priority {priority}")
+    except (AttributeError, OSError) as e:
+        # Needs root (or CAP_SYS_NICE) and a CPU that exists; run unpinned otherwise
+        log_message(f"Could not set real-time scheduling: {e}", "WARNING")
+
+# Write the levels of the masked motor pins in one group write
+def apply_mask(bits, mask=MOTOR_MASK_ALL):
+    if gpio_regs is not None:
+        # Clear before set so a pin pair is never driven high together
+        gpio_regs[GPCLR0] = GPIO_REGISTER_MASKS[~bits & mask]
+        gpio_regs[GPSET0] = GPIO_REGISTER_MASKS[bits & mask]
+        return
+    if gpio_handle is None:
+        return  # GPIO already released during shutdown
     try:
-        state = "dh" if value else "dl"  # dh = drive high, dl = drive low
-        subprocess.run(["sudo", "pinctrl", "set", str(pin), state], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        lgpio.group_write(gpio_handle, MOTOR_PINS[0], bits, mask)
     except Exception as e:
-        log_message(f"Error setting pin {pin}: {e}", "ERROR")
-        # Try with GPIO if installed and accessible
-        try:
-            import RPi.GPIO as GPIO
-            GPIO.setmode(GPIO.BCM)  # Use BCM numbering
-            GPIO.setup(pin, GPIO.OUT)  # Set as output
-            GPIO.output(pin, value)
-        except:
-            pass
+        log_message(f"Error writing motor pins: {e}", "ERROR")
 
 # Setup GPIO pins
 def setup_gpio():
-    # Set all control pins as outputs with pull-down and initial low state
-    all_pins = [FL_IN1, FL_IN2, FR_IN1, FR_IN2, BL_IN1, BL_IN2, BR_IN1, BR_IN2]
+    global gpio_handle
+    
+    # Claim all control pins as outputs with pull-down and initial low state
+    # in one call, instead of running sudo pinctrl once per pin
     log_message("Setting up GPIO pins...")
-    for pin in all_pins:
+    try:
+        gpio_handle = lgpio.gpiochip_open(GPIO_CHIP)
+        lgpio.group_claim_output(gpio_handle, MOTOR_PINS, [0] * len(MOTOR_PINS), lgpio.SET_PULL_DOWN)
+    except Exception as e:
+        log_message(f"Error setting up GPIO: {e}", "ERROR")
+        return
+    
+    if USE_GPIOMEM:
+        map_gpio_registers()
+
+def map_gpio_registers():
+    """Map the GPIO registers through /dev/gpiomem for syscall-free motor writes"""
+    global gpio_mem, gpio_regs
+    
+    try:
+        with open("/proc/device-tree/compatible", "rb") as f:
+            compatible = f.read()
+    except OSError:
+        return  # Not a Raspberry Pi device tree
+    if not any(soc in compatible for soc in GPIOMEM_SOCS):
+        return  # Different GPIO block (e.g. RP1) - keep using lgpio
+    
+    try:
+        fd = os.open(GPIOMEM_PATH, os.O_RDWR | os.O_SYNC)
         try:
-            subprocess.run(["sudo", "pinctrl", "set", str(pin), "op", "pd", "dl"], 
-                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except Exception as e:
-            log_message(f"Error setting up GPIO {pin}: {e}", "ERROR")
+            gpio_mem = mmap.mmap(fd, mmap.PAGESIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        gpio_regs = (ctypes.c_uint32 * (mmap.PAGESIZE // 4)).from_buffer(gpio_mem)
+        log_message("Motor pins are written through /dev/gpiomem")
+    except OSError as e:
+        log_message(f"Could not map {GPIOMEM_PATH}, using lgpio writes: {e}", "WARNING")
 
 # Cleanup GPIO pins
 def cleanup_gpio():
-    all_pins = [FL_IN1, FL_IN2, FR_IN1, FR_IN2, BL_IN1, BL_IN2, BR_IN1, BR_IN2]
+    global gpio_handle, gpio_mem, gpio_regs
+    
+    if gpio_handle is None:
+        return  # Already cleaned up
+    
     log_message("Cleaning up GPIO pins...")
+    
+    # Drop the register mapping first so the final write goes through lgpio
+    if gpio_regs is not None:
+        gpio_regs = None
+        gpio_mem.close()
+        gpio_mem = None
+    
     try:
-        for pin in all_pins:
-            subprocess.run(["sudo", "pinctrl", "set", str(pin), "dl"], 
-                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        lgpio.group_write(gpio_handle, MOTOR_PINS[0], MOTOR_STOPPED, MOTOR_MASK_ALL)
+        lgpio.gpiochip_close(gpio_handle)
     except Exception as e:
         log_message(f"Error during GPIO cleanup: {e}", "ERROR")
+    finally:
+        gpio_handle = None
+
+# Pin levels, log message and direction of travel for every motor state.
+# The direction (moving_backward) is left as is when it is None - turning in
+# place and stopping keep the current one. States without a message are
+# logged by their caller.
+MOTOR_CMDS = {
+    "forward": (MOTOR_FORWARD, "Moving forward", False),
+    "backward": (MOTOR_BACKWARD, "Moving backward", True),
+    "left": (MOTOR_TURN_LEFT, "Turning left", None),
+    "right": (MOTOR_TURN_RIGHT, "Turning right", None),
+    "left_forward": (MOTOR_LEFT_FORWARD, "Left forward", False),
+    "right_forward": (MOTOR_RIGHT_FORWARD, "Right forward", False),
+    "search_right": (MOTOR_SEARCH_RIGHT, None, None),
+    "search_left": (MOTOR_SEARCH_LEFT, None, None),
+    "stopped": (MOTOR_STOPPED, "Stopping motors", None),
+}
+
+def set_motor_state(state):
+    """Switch the motors to a MOTOR_CMDS state, skipping the write if already in it"""
+    global moving_backward, current_motor_state
+    
+    # No lock: while running only the line detection thread drives the motors,
+    # a whole state is one group write, and shutdown waits for that thread
+    # before cleanup_gpio forces every pin low
+    if current_motor_state == state:
+        return  # Already in this state
+    
+    bits, message, backward = MOTOR_CMDS[state]
+    if backward is not None and backward != moving_backward:
+        moving_backward = backward
+        # The callbacks ignored the sensor we now face, so re-read it
+        sync_obstacle()
+    if message is not None:
+        log_message(message, throttle_key=state)
+    
+    apply_mask(bits)
+    current_motor_state = state
 
 def move_forward():
     """Move the robot forward in a straight line"""
-    global moving_backward, current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "forward":
-            return  # Already in this state
-        
-        moving_backward = False
-        log_message("Moving forward", throttle_key="move_forward")
-        
-        # Front Left backward
-        set_pin(FL_IN1, 0)
-        set_pin(FL_IN2, 1)
-        
-        # Front Right backward
-        set_pin(FR_IN1, 0)
-        set_pin(FR_IN2, 1)
-        
-        # Back Left backward
-        set_pin(BL_IN1, 0)
-        set_pin(BL_IN2, 1)
-        
-        # Back Right backward
-        set_pin(BR_IN1, 0)
-        set_pin(BR_IN2, 1)
-        
-        current_motor_state = "forward"
+    set_motor_state("forward")
 
 def move_backward():
     """Move the robot backward"""
-    global moving_backward, current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "backward":
-            return  # Already in this state
-        
-        moving_backward = True
-        log_message("Moving backward", throttle_key="move_backward")
-        
-        # Front Left forward
-        set_pin(FL_IN1, 1)
-        set_pin(FL_IN2, 0)
-        
-        # Front Right forward
-        set_pin(FR_IN1, 1)
-        set_pin(FR_IN2, 0)
-        
-        # Back Left forward
-        set_pin(BL_IN1, 1)
-        set_pin(BL_IN2, 0)
-        
-        # Back Right forward
-        set_pin(BR_IN1, 1)
-        set_pin(BR_IN2, 0)
-        
-        current_motor_state = "backward"
+    set_motor_state("backward")
 
 def turn_left():
     """
@@ -206,33 +374,7 @@ def turn_left():
     - Left motors forward
     - Right motors backward
     """
-    global current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "left":
-            return  # Already in this state
-            
-        log_message("Turning left", throttle_key="turn_left")
-        
-        # Left motors forward
-        # Front Left forward
-        set_pin(FL_IN1, 1)
-        set_pin(FL_IN2, 0)
-        
-        # Back Left forward
-        set_pin(BL_IN1, 1)
-        set_pin(BL_IN2, 0)
-        
-        # Right motors backward
-        # Front Right backward
-        set_pin(FR_IN1, 0)
-        set_pin(FR_IN2, 1)
-        
-        # Back Right backward
-        set_pin(BR_IN1, 0)
-        set_pin(BR_IN2, 1)
-        
-        current_motor_state = "left"
+    set_motor_state("left")
 
 def turn_right():
     """
@@ -240,33 +382,7 @@ def turn_right():
     - Left motors backward
     - Right motors forward
     """
-    global current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "right":
-            return  # Already in this state
-            
-        log_message("Turning right", throttle_key="turn_right")
-        
-        # Left motors backward
-        # Front Left backward
-        set_pin(FL_IN1, 0)
-        set_pin(FL_IN2, 1)
-        
-        # Back Left backward
-        set_pin(BL_IN1, 0)
-        set_pin(BL_IN2, 1)
-        
-        # Right motors forward
-        # Front Right forward
-        set_pin(FR_IN1, 1)
-        set_pin(FR_IN2, 0)
-        
-        # Back Right forward
-        set_pin(BR_IN1, 1)
-        set_pin(BR_IN2, 0)
-        
-        current_motor_state = "right"
+    set_motor_state("right")
 
 def left_forward():
     """
@@ -274,28 +390,7 @@ def left_forward():
     - All left motors off
     - All right motors on (turning the robot left)
     """
-    global moving_backward, current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "left_forward":
-            return  # Already in this state
-            
-        moving_backward = False
-        log_message("Left forward", throttle_key="left_forward")
-        
-        # All left motors off
-        set_pin(FL_IN1, 0)
-        set_pin(FL_IN2, 0)
-        set_pin(BL_IN1, 0)
-        set_pin(BL_IN2, 0)
-        
-        # All right motors on (backward, which is forward motion)
-        set_pin(FR_IN1, 0)
-        set_pin(FR_IN2, 1)
-        set_pin(BR_IN1, 0)
-        set_pin(BR_IN2, 1)
-        
-        current_motor_state = "left_forward"
+    set_motor_state("left_forward")
 
 def right_forward():
     """
@@ -303,68 +398,80 @@ def right_forward():
     - All right motors off
     - All left motors on (turning the robot right)
     """
-    global moving_backward, current_motor_state
-    
-    with motor_lock:
-        if current_motor_state == "right_forward":
-            return  # Already in this state
-            
-        moving_backward = False
-        log_message("Right forward", throttle_key="right_forward")
-        
-        # All right motors off
-        set_pin(FR_IN1, 0)
-        set_pin(FR_IN2, 0)
-        set_pin(BR_IN1, 0)
-        set_pin(BR_IN2, 0)
-        
-        # All left motors on (backward, which is forward motion)
-        set_pin(FL_IN1, 0)
-        set_pin(FL_IN2, 1)
-        set_pin(BL_IN1, 0)
-        set_pin(BL_IN2, 1)
-        
-        current_motor_state = "right_forward"
+    set_motor_state("right_forward")
 
 def stop():
     """Stop all motors"""
-    global current_motor_state
+    set_motor_state("stopped")
+
+# === CONTROL DECISION ===
+# Steering states returned by decide_steering, indexing STEERING_ACTIONS
+STEER_FORWARD = 0
+STEER_LEFT_FORWARD = 1
+STEER_RIGHT_FORWARD = 2
+STEER_TURN_LEFT = 3
+STEER_TURN_RIGHT = 4
+STEERING_ACTIONS = (move_forward, left_forward, right_forward, turn_left, turn_right)
+# Loop delay for each steering state, in the same order (see DELAY_BY_STATE)
+STEERING_DELAYS = (DELAY_BY_STATE["forward"], DEFAULT_LOOP_DELAY, DEFAULT_LOOP_DELAY,
+                   DELAY_BY_STATE["left"], DELAY_BY_STATE["right"])
+
+@njit(cache=True)
+def decide_steering(error, prev_error, integral):
+    """
+    Run one PID step and pick the steering state and loop delay for the
+    current line error.
     
-    with motor_lock:
-        if current_motor_state == "stopped":
-            return  # Already stopped
-            
-        log_message("Stopping motors", throttle_key="stop_motors")
-        
-        # Stop all motors
-        set_pin(FL_IN1, 0)
-        set_pin(FL_IN2, 0)
-        set_pin(FR_IN1, 0)
-        set_pin(FR_IN2, 0)
-        set_pin(BL_IN1, 0)
-        set_pin(BL_IN2, 0)
-        set_pin(BR_IN1, 0)
-        set_pin(BR_IN2, 0)
-        
-        current_motor_state = "stopped"
+    Returns:
+        tuple: (steering state, updated integral, PID output, loop delay)
+    """
+    # PID control computation
+    integral = max(-100, min(100, integral + error))  # Prevent integral windup
+    derivative = error - prev_error
+    output = Kp * error + Ki * integral + Kd * derivative
+    
+    # Implement a state machine for smoother motion:
+    # 1. If we're close to centered, go straight
+    # 2. For small-medium errors, use gentle turns
+    # 3. Only use sharp turns for large errors
+    if abs(error) < 30:  # Very small error - go straight
+        state = STEER_FORWARD
+    elif error > 0:
+        # Extreme error - use full turn, otherwise gentle correction
+        state = STEER_TURN_LEFT if error > 150 else STEER_LEFT_FORWARD
+    else:
+        state = STEER_TURN_RIGHT if error < -150 else STEER_RIGHT_FORWARD
+    
+    return state, integral, output, STEERING_DELAYS[state]
 
 # === ULTRASONIC SENSOR FUNCTIONS ===
 def setup_sensors():
-    """Initialize GPIO pins for ultrasonic sensors."""
-    global front_trigger, front_echo, rear_trigger, rear_echo
+    """Initialize the ultrasonic sensors."""
+    global front_sensor, rear_sensor
     
     try:
-        # Initialize front sensor
-        front_trigger = DigitalOutputDevice(FRONT_TRIG_PIN, initial_value=False)
-        front_echo = DigitalInputDevice(FRONT_ECHO_PIN, pull_up=None, active_state=True)
-        
-        # Initialize rear sensor
-        rear_trigger = DigitalOutputDevice(REAR_TRIG_PIN, initial_value=False)
-        rear_echo = DigitalInputDevice(REAR_ECHO_PIN, pull_up=None, active_state=True)
+        # gpiozero triggers and times the echo on its own background thread,
+        # so reading a distance is just a property access
+        front_sensor = DistanceSensor(echo=FRONT_ECHO_PIN, trigger=FRONT_TRIG_PIN,
+                                      threshold_distance=OBSTACLE_DISTANCE / 100,
+                                      max_distance=SENSOR_MAX_DISTANCE, queue_len=SENSOR_QUEUE_LEN)
+        rear_sensor = DistanceSensor(echo=REAR_ECHO_PIN, trigger=REAR_TRIG_PIN,
+                                     threshold_distance=OBSTACLE_DISTANCE / 100,
+                                     max_distance=SENSOR_MAX_DISTANCE, queue_len=SENSOR_QUEUE_LEN)
+        
+        # Obstacle changes are pushed to us instead of polled
+        front_sensor.when_in_range = _on_front_obstacle
+        front_sensor.when_out_of_range = _on_front_clear
+        rear_sensor.when_in_range = _on_rear_obstacle
+        rear_sensor.when_out_of_range = _on_rear_clear
         
         # Allow sensors to settle
         log_message("Ultrasonic sensors initializing...")
         time.sleep(1)
+        
+        # gpiozero fires no callback for the first reading, so pick up an
+        # obstacle that is already in range now
+        sync_obstacle()
         log_message(f"Front sensor ready on TRIG={FRONT_TRIG_PIN}, ECHO={FRONT_ECHO_PIN}")
         log_message(f"Rear sensor ready on TRIG={REAR_TRIG_PIN}, ECHO={REAR_ECHO_PIN}")
         
@@ -373,117 +480,89 @@ def setup_sensors():
         log_message(f"Error setting up ultrasonic sensors: {e}", "ERROR")
         return False
 
-def get_distance(trigger, echo):
+def get_distance(sensor):
     """
-    Trigger an ultrasonic sensor and calculate the distance.
+    Read the latest distance from an ultrasonic sensor.
     
     Args:
-        trigger: The trigger pin object
-        echo: The echo pin object
+        sensor: The DistanceSensor object
         
     Returns:
         float: Distance in centimeters, -1 if measurement failed
     """
-    if trigger is None or echo is None:
+    if sensor is None:
         return -1
     
     try:
-        # Send 10us pulse to trigger
-        trigger.on()
-        time.sleep(0.00001)  # 10 microseconds
-        trigger.off()
-        
-        # Wait for echo to go high (start of pulse)
-        start_time = time.time()
-        timeout = start_time + 0.03  # 30ms timeout, reduced for faster response
-        
-        while not echo.is_active and time.time() < timeout:
-            start_time = time.time()
-            
-        if time.time() >= timeout:
-            return -1
-            
-        # Wait for echo to go low (end of pulse)
-        end_time = time.time()
-        timeout = end_time + 0.03  # 30ms timeout, reduced for faster response
-        
-        while echo.is_active and time.time() < timeout:
-            end_time = time.time()
-            
-        if time.time() >= timeout:
-            return -1
-            
-        # Calculate distance
-        duration = end_time - start_time
-        distance = (duration * 34300) / 2  # Speed of sound = 343 m/s
-        
-        return distance
-        
+        return sensor.distance * 100
     except Exception as e:
         log_message(f"Error measuring distance: {e}", "ERROR")
         return -1
 
-def distance_sensor_thread():
-    """Thread function to continuously read distances from ultrasonic sensors"""
-    global front_distance, rear_distance, running, obstacle_detected, moving_backward
+def set_obstacle(detected, sensor_name, distance):
+    """Update the shared obstacle flag, logging only on change"""
+    # The lock only serializes the check-and-set between the two sensors'
+    # callback threads so each change is logged once
+    with distance_lock:
+        if obstacle_event.is_set() == detected:
+            return
+        if detected:
+            obstacle_event.set()
+        else:
+            obstacle_event.clear()
     
-    # For throttling distance reports
-    last_distance_report = 0
-    distance_report_interval = 3.0  # seconds
+    if detected:
+        log_message(f"{sensor_name.upper()} OBSTACLE DETECTED! Distance: {distance:.1f} cm", "WARNING")
+    else:
+        log_message(f"{sensor_name.capitalize()} obstacle cleared. Distance: {distance:.1f} cm")
+
+def sync_obstacle():
+    """
+    Set the obstacle flag from the current reading of the sensor facing the
+    direction of travel.
     
-    while running:
-        try:
-            # Determine which sensor to check based on movement direction
-            if moving_backward:
-                # Check rear sensor when moving backward
-                current_distance = get_distance(rear_trigger, rear_echo)
-                if current_distance > 0:
-                    with distance_lock:
-                        rear_distance = current_distance
-                        # Update obstacle detection status
-                        if rear_distance < OBSTACLE_DISTANCE:
-                            if not obstacle_detected:
-                                log_message(f"REAR OBSTACLE DETECTED! Distance: {rear_distance:.1f} cm", "WARNING")
-                                obstacle_detected = True
-                        else:
-                            if obstacle_detected:
-                                log_message(f"Rear obstacle cleared. Distance: {rear_distance:.1f} cm")
-                                obstacle_detected = False
-                
-                # Occasionally report distance
-                current_time = time.time()
-                if current_time - last_distance_report > distance_report_interval:
-                    log_message(f"Rear distance: {rear_distance:.1f} cm", throttle_key="distance_report")
-                    last_distance_report = current_time
-                
-            else:
-                # Check front sensor when moving forward
-                current_distance = get_distance(front_trigger, front_echo)
-                if current_distance > 0:
-                    with distance_lock:
-                        front_distance = current_distance
-                        # Update obstacle detection status
-                        if front_distance < OBSTACLE_DISTANCE:
-                            if not obstacle_detected:
-                                log_message(f"FRONT OBSTACLE DETECTED! Distance: {front_distance:.1f} cm", "WARNING")
-                                obstacle_detected = True
-                        else:
-                            if obstacle_detected:
-                                log_message(f"Front obstacle cleared. Distance: {front_distance:.1f} cm")
-                                obstacle_detected = False
-                
-                # Occasionally report distance
-                current_time = time.time()
-                if current_time - last_distance_report > distance_report_interval:
-                    log_message(f"Front distance: {front_distance:.1f} cm", throttle_key="distance_report")
-                    last_distance_report = current_time
-            
-            # Sleep to avoid overwhelming the CPU and keep sensor reading at ~0.5 second intervals
-            time.sleep(0.5)
-            
-        except Exception as e:
-            log_message(f"Error in distance sensor thread: {e}", "ERROR")
-            time.sleep(1)  # Delay longer on error
+    The range callbacks only fire on crossings, so this covers an obstacle
+    that was already in range at startup or when the direction changes.
+    """
+    if moving_backward:
+        sensor, sensor_name = rear_sensor, "rear"
+    else:
+        sensor, sensor_name = front_sensor, "front"
+    if sensor is None:
+        return
+    
+    try:
+        in_range = sensor.in_range  # gpiozero: not is_active, i.e. under threshold_distance
+    except Exception as e:
+        log_message(f"Error reading {sensor_name} sensor: {e}", "ERROR")
+        return
+    set_obstacle(in_range, sensor_name, get_distance(sensor))
+
+# gpiozero calls these from its own sensor thread when a reading crosses
+# OBSTACLE_DISTANCE; only the sensor facing the direction of travel counts
+def _on_front_obstacle():
+    global front_distance
+    front_distance = get_distance(front_sensor)
+    if not moving_backward:
+        set_obstacle(True, "front", front_distance)
+
+def _on_front_clear():
+    global front_distance
+    front_distance = get_distance(front_sensor)
+    if not moving_backward:
+        set_obstacle(False, "front", front_distance)
+
+def _on_rear_obstacle():
+    global rear_distance
+    rear_distance = get_distance(rear_sensor)
+    if moving_backward:
+        set_obstacle(True, "rear", rear_distance)
+
+def _on_rear_clear():
+    global rear_distance
+    rear_distance = get_distance(rear_sensor)
+    if moving_backward:
+        set_obstacle(False, "rear", rear_distance)
 
 # === CAMERA AND LINE DETECTION FUNCTIONS ===
 def initialize_camera():
@@ -491,16 +570,21 @@ def initialize_camera():
     try:
         camera = cv2.VideoCapture(0)  # Use first camera
         
+        # Request raw YUYV so the luma (Y) plane can be used directly as
+        # grayscale, skipping the driver's YUYV->BGR conversion and our BGR->GRAY
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+        camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        
         # Set lower resolution for higher FPS
         camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
         camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
         
-        # Try to increase FPS by setting buffer size
-        camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Keep the driver queue as short as possible so grabbed frames are fresh
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, CAMERA_BUFFERS)
         
         if camera.isOpened():
             # Try to set higher FPS
-            camera.set(cv2.CAP_PROP_FPS, 30)
+            camera.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
             actual_width = camera.get(cv2.CAP_PROP_FRAME_WIDTH)
             actual_height = camera.get(cv2.CAP_PROP_FRAME_HEIGHT)
             actual_fps = camera.get(cv2.CAP_PROP_FPS)
@@ -513,126 +597,119 @@ def initialize_camera():
         log_message(f"Error initializing camera: {e}", "ERROR")
         return None
 
+def camera_capture_thread(camera, stop_event):
+    """Read frames continuously so the newest one is always ready for the line loop"""
+    global frame_back, frame_ready, frame_seq
+    
+    while running and not stop_event.is_set():
+        # Decode into the back slot's array, which nobody else is using
+        ret, frame = camera.read(frame_slots[frame_back])
+        if not ret:
+            log_message("Failed to capture frame from camera", "ERROR", throttle_key="camera_fail")
+            time.sleep(0.1)
+            continue
+        frame_slots[frame_back] = frame
+        
+        # Publish it: the back slot becomes ready and the old ready slot is reused
+        with frame_cond:
+            frame_back, frame_ready = frame_ready, frame_back
+            frame_seq += 1
+            frame_cond.notify()
+
+def take_latest_frame(last_seq, timeout):
+    """
+    Wait for a frame newer than last_seq and take it for processing.
+    
+    Returns:
+        tuple: (frame sequence number, frame), frame is None on timeout
+    """
+    global frame_ready, frame_front
+    
+    with frame_cond:
+        if not frame_cond.wait_for(lambda: frame_seq != last_seq, timeout):
+            return last_seq, None
+        # The slot we were processing goes back to the pool as the ready slot
+        frame_ready, frame_front = frame_front, frame_ready
+        return frame_seq, frame_slots[frame_front]
+
 def process_frame(frame):
-    """Process the camera frame to detect the line with enhanced algorithms"""
+    """
+    Count dark (line) pixels per column in the bottom band of the frame.
+    
+    Thresholding and the vertical sum run back to back as OpenCV's SIMD
+    (NEON on the Pi) kernels over one reused buffer.
+    
+    Returns:
+        ndarray: Dark pixel count for each frame column, None on error
+    """
     try:
-        # Use a larger ROI to avoid losing the line - capture more of the frame
-        height, width = frame.shape[:2]
-        roi = frame[int(height*0.3):height, :]  # Use more of the frame (70% instead of 50%)
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-        
-        # Apply basic blur (faster than Gaussian)
-        blurred = cv2.blur(gray, (5, 5))
-        
-        # Try multiple thresholding methods and combine results for more robust detection
-        
-        # Method 1: Simple binary threshold
-        _, thresh1 = cv2.threshold(blurred, 60, 255, cv2.THRESH_BINARY_INV)
-        
-        # Method 2: Adaptive threshold
-        thresh2 = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                                      cv2.THRESH_BINARY_INV, 11, 7)
-        
-        # Combine the results (logical OR)
-        combined = cv2.bitwise_or(thresh1, thresh2)
-        
-        # Optional: Apply morphological operations to clean up the result
-        kernel = np.ones((5, 5), np.uint8)
-        dilated = cv2.dilate(combined, kernel, iterations=1)
-        eroded = cv2.erode(dilated, kernel, iterations=1)
-        
-        return eroded
+        band = frame[LINE_BAND]
+        
+        # Grayscale: a YUYV frame (H, W, 2) already carries luma in channel 0;
+        # fall back to a BGR conversion if the camera ignored the YUYV request
+        if band.ndim == 2:
+            luma = band
+        elif band.shape[2] == 2:
+            luma = band[:, :, 0]
+        else:
+            luma = cv2.cvtColor(band, cv2.COLOR_BGR2GRAY)
+        
+        # Dark pixels become 1 (luma <= threshold-1, i.e. < threshold), written
+        # into the preallocated mask when the camera honoured the requested
+        # resolution, otherwise OpenCV allocates
+        mask = _dark_mask if luma.shape == _dark_mask.shape else None
+        _, dark = cv2.threshold(luma, LINE_DARK_THRESHOLD - 1, 1, cv2.THRESH_BINARY_INV, dst=mask)
+        return cv2.reduce(dark, 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel()
     except Exception as e:
         log_message(f"Error processing frame: {e}", "ERROR")
         return None
 
-def get_line_position(binary_img):
-    """Find the position of the line in the binary image with enhanced recovery"""
+def get_line_position(column_profile, now):
+    """Find the position of the line from its per-column pixel counts with enhanced recovery"""
     global last_line_pos, last_line_time
     
     try:
-        if binary_img is None:
+        if column_profile is None:
             return None
-            
-        # Try a more advanced line detection approach
-        # First look for contours as before
-        height, width = binary_img.shape[:2]
-        
-        # Find contours in the binary image
-        contours, _ = cv2.findContours(binary_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        # Filter contours by minimum area and aspect ratio to better identify lines
-        valid_contours = []
-        for c in contours:
-            area = cv2.contourArea(c)
-            if area < 50:  # Skip very small contours
-                continue
-                
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(c)
-            
-            # Calculate aspect ratio
-            aspect_ratio = float(w) / h if h > 0 else 0
+        # Split the dark columns into connected runs (1-D components) so stray
+        # dark specks elsewhere in the band don't pull the centroid off the line
+        dark = np.concatenate(([False], column_profile > 0, [False]))
+        edges = np.flatnonzero(dark[1:] != dark[:-1])
+        starts, ends = edges[0::2], edges[1::2]
+        
+        # Dark pixel count and column-weighted count of every run from two
+        # cumulative sums; keep the largest run
+        columns = COLUMN_INDEX if column_profile.size == COLUMN_INDEX.size else np.arange(column_profile.size)
+        cumulative = np.concatenate(([0], np.cumsum(column_profile, dtype=np.int32)))
+        weighted = np.concatenate(([0], np.cumsum(column_profile * columns, dtype=np.int32)))
+        areas = cumulative[ends] - cumulative[starts]
+        largest = int(np.argmax(areas)) if areas.size else -1
+        
+        if largest >= 0 and areas[largest] >= MIN_LINE_PIXELS:
+            # The line position is the weighted centroid of the largest run
+            start, end = starts[largest], ends[largest]
+            cx = int((weighted[end] - weighted[start]) / areas[largest])
             
-            # Lines typically have certain characteristics:
-            # - Reasonable size
-            # - Either long and thin (high aspect ratio) or blob-like for intersection points
-            if (area > 100) or (aspect_ratio > 2.0) or (w > width/5):
-                valid_contours.append(c)
-        
-        if valid_contours:
-            # Find the largest contour by area
-            largest_contour = max(valid_contours, key=cv2.contourArea)
-            
-            # Calculate the centroid of the contour
-            M = cv2.moments(largest_contour)
-            if M["m00"] > 0:  # Ensure we don't divide by zero
-                cx = int(M["m10"] / M["m00"])
-                
-                # Check if this is a reasonable position relative to last position
-                # This helps with sudden jumps or false readings
-                if last_line_pos is not None:
-                    # If the position changes too drastically, ease into the new position
-                    if abs(cx - last_line_pos) > 100:
-                        # Move halfway toward the new position (smoother transitions)
-                        cx = last_line_pos + ((cx - last_line_pos) // 2)
-                        log_message(f"Smoothing position change: {last_line_pos}->{cx}", 
-                                   throttle_key="position_smoothing")
-                
-                last_line_pos = cx
-                last_line_time = time.time()
-                return cx
-            
-        # If contour method failed, try a simplified sum-based approach
-        # This is especially useful for situations where the line is thin or faint
-        if not valid_contours:
-            # Sum each column to find where the white pixels are concentrated
-            column_sums = np.sum(binary_img, axis=0)
-            
-            # Find columns with significant white pixel count
-            threshold = np.max(column_sums) * 0.7  # 70% of maximum value
-            white_cols = np.where(column_sums > threshold)[0]
+            # Blend with the last position using an integer EMA (alpha/256) to
+            # damp sudden jumps or false readings; +128 rounds to nearest so a
+            # steady line is reached exactly instead of settling 1 px short
+            if last_line_pos is not None:
+                if abs(cx - last_line_pos) > LINE_JUMP_PIXELS:
+                    # Drastic change - only move halfway toward the new position
+                    cx = (LINE_EMA_ALPHA_JUMP * cx + (256 - LINE_EMA_ALPHA_JUMP) * last_line_pos + 128) >> 8
+                    log_message(f"Smoothing position change: {last_line_pos}->{cx}", 
+                               throttle_key="position_smoothing")
+                else:
+                    cx = (LINE_EMA_ALPHA * cx + (256 - LINE_EMA_ALPHA) * last_line_pos + 128) >> 8
             
-            if len(white_cols) > 0:
-                # Calculate the centroid of these columns
-                centroid = int(np.mean(white_cols))
-                
-                # Apply similar smoothing as above
-                if last_line_pos is not None:
-                    if abs(centroid - last_line_pos) > 100:
-                        centroid = last_line_pos + ((centroid - last_line_pos) // 2)
-                
-                log_message("Used column sum method for line detection", throttle_key="column_method")
-                last_line_pos = centroid
-                last_line_time = time.time()
-                return centroid
+            last_line_pos = cx
+            last_line_time = now
+            return cx
         
         # Enhanced line memory:
         if last_line_pos is not None:
-            current_time = time.time()
-            time_since_line = current_time - last_line_time
+            time_since_line = now - last_line_time
             
             # Use remembered position with confidence that decreases over time
             if time_since_line < line_memory_timeout:
@@ -644,10 +721,89 @@ def get_line_position(binary_img):
         log_message(f"Error getting line position: {e}", "ERROR")
         return None
 
+# === LINE RECOVERY ===
+# Recovery states for a frame without a line, indexing RECOVERY_ACTIONS
+RECOVER_BRIEF = 0         # Lost only briefly - keep the last direction
+RECOVER_MEMORY = 1        # Recent memory of the line position
+RECOVER_SEARCH = 2        # Lost for a while - sweep toward the last direction
+RECOVER_SCAN = 3          # Truly lost - slow 360 scan
+
+def recovery_state(memory_valid):
+    """Pick the recovery strategy for a frame without a line"""
+    if memory_valid:
+        return RECOVER_MEMORY
+    if line_lost_counter < max_line_lost_count:
+        return RECOVER_BRIEF
+    return RECOVER_SCAN if last_direction == "forward" else RECOVER_SEARCH
+
+def recover_brief_loss(frame_center, now, verbose):
+    """We've only lost the line briefly, continue in the last direction"""
+    if verbose:
+        log_message(f"Brief line loss, continuing in last direction: {last_direction}")
+    
+    if last_direction == "left":
+        left_forward()
+    elif last_direction == "right":
+        right_forward()
+    else:
+        move_forward()
+
+def recover_with_memory(frame_center, now, verbose):
+    """We have a recent memory - continue in the same direction"""
+    if verbose:
+        log_message(f"Using memory to continue: {now - last_line_time:.1f}s ago")
+    
+    # Bias the movement based on where the line was last seen
+    if last_line_pos < frame_center - 50:
+        # Line was on the left side
+        left_forward()
+    elif last_line_pos > frame_center + 50:
+        # Line was on the right side
+        right_forward()
+    else:
+        # Line was near center
+        move_forward()
+
+def recover_search_last_direction(frame_center, now, verbose):
+    """We've lost the line for many frames - sweep toward where it was heading"""
+    if last_direction == "left":
+        if verbose:
+            log_message("Line search: sweeping right to find line")
+        right_forward()
+    else:
+        if verbose:
+            log_message("Line search: sweeping left to find line")
+        left_forward()
+
+def recover_scan(frame_center, now, verbose):
+    """If we're truly lost, do a slow 360 scan"""
+    global search_started, search_phase
+    
+    # The scan is a square wave with a fixed period in time, so its timing
+    # doesn't depend on how fast the loop happens to run
+    if search_started is None:
+        search_started = now
+    phase = int((now - search_started) / search_phase_time) & 1
+    
+    # Only log when the direction flips; set_motor_state itself skips the
+    # write while the motors are already turning this way
+    if phase != search_phase:
+        search_phase = phase
+        if phase == 0:
+            log_message("Line search: slow right turn")
+        else:
+            log_message("Line search: slow left turn")
+    
+    # Slow rotation for searching
+    set_motor_state("search_left" if phase else "search_right")
+
+RECOVERY_ACTIONS = (recover_brief_loss, recover_with_memory, recover_search_last_direction, recover_scan)
+
 def line_detection_thread():
     """Thread function for line detection and following"""
-    global running, obstacle_detected, line_detected, last_line_pos, last_line_time
-    global line_lost_counter, current_motor_state, last_direction
+    global running, line_detected, last_line_pos, last_line_time
+    global line_lost_counter, last_direction
+    global search_started, search_phase
     
     # PID control variables
     prev_error = 0
@@ -659,72 +815,83 @@ def line_detection_thread():
         log_message("Failed to initialize camera! Exiting line detection thread.", "ERROR")
         return
     
+    # Capture runs alongside processing, so the loop never waits on a decode
+    capture_stop = threading.Event()
+    capture_thread = threading.Thread(target=camera_capture_thread, args=(camera, capture_stop), daemon=True)
+    capture_thread.start()
+    frame_id = 0
+    
+    # Compile the steering decision now (same int argument types as the loop)
+    # so the first line-found frame doesn't stall on numba's JIT
+    decide_steering(0, 0, 0)
+    
+    # Keep the control loop on its own core ahead of normal tasks. Done after
+    # starting the capture thread: new threads inherit affinity and policy,
+    # and capture must keep running on other cores while the loop works
+    set_realtime(LINE_THREAD_CPU, LINE_THREAD_PRIORITY)
+    
     log_message("Line detection started...")
     frames_processed = 0
-    start_time = time.time()
+    
+    # Recovery logs are throttled here rather than through log_message's
+    # throttle keys, so most lost-line frames never enter log_message
+    last_recovery = -1
+    last_recovery_log = 0.0
+    start_time = time.monotonic()
     last_fps_report_time = start_time
     
     try:
         while running:
-            loop_start = time.time()
+            # One monotonic timestamp per iteration serves the FPS window, line
+            # memory and loop pacing (immune to wall-clock adjustments)
+            loop_start = now = time.monotonic()
             
             # Check if obstacle detected
-            with distance_lock:
-                local_obstacle_detected = obstacle_detected
-            
-            if local_obstacle_detected:
+            if obstacle_event.is_set():
                 # If obstacle detected, stop the robot
                 stop()
                 # Don't process frames too frequently when stopped
                 time.sleep(0.1)
                 continue
             
-            # Capture frame from camera
-            with camera_lock:
-                ret, frame = camera.read()
+            # Take the newest frame from the capture thread
+            frame_id, frame = take_latest_frame(frame_id, FRAME_WAIT_TIMEOUT)
             
-            if not ret:
-                log_message("Failed to capture frame from camera", "ERROR", throttle_key="camera_fail")
-                time.sleep(0.1)
+            if frame is None:
+                log_message("No new frame from camera", "ERROR", throttle_key="camera_wait")
                 continue
             
             # Process the frame to detect the line
-            binary = process_frame(frame)
-            line_pos = get_line_position(binary)
+            line_profile = process_frame(frame)
+            line_pos = get_line_position(line_profile, now)
             
             # Calculate FPS occasionally
             frames_processed += 1
-            current_time = time.time()
-            if current_time - last_fps_report_time >= 5.0:  # Report every 5 seconds
-                fps = frames_processed / (current_time - last_fps_report_time)
+            if now - last_fps_report_time >= 5.0:  # Report every 5 seconds
+                fps = frames_processed / (now - last_fps_report_time)
                 log_message(f"Line detection running at {fps:.1f} FPS")
                 frames_processed = 0
-                last_fps_report_time = current_time
+                last_fps_report_time = now
             
             if line_pos is not None:
-                # Line detected - reset the line lost counter
+                # Line detected - reset the line lost counter and the scan
                 line_lost_counter = 0
+                search_started = None
+                search_phase = -1
+                last_recovery = -1
                 
                 # Update line detected status if needed
                 if not line_detected:
                     log_message("Line detected")
                     line_detected = True
                 
-                # Calculate the center of the frame
-                frame_center = binary.shape[1] // 2
-                
                 # Calculate error (distance from line to center)
-                error = frame_center - line_pos
+                error = FRAME_CENTER - line_pos
                 
-                # PID control computation
-                integral = max(-100, min(100, integral + error))  # Prevent integral windup
-                derivative = error - prev_error
-                output = Kp * error + Ki * integral + Kd * derivative
+                # PID step and steering decision (compiled when numba is available)
+                steering_state, integral, output, target_delay = decide_steering(error, prev_error, integral)
                 prev_error = error
                 
-                # Create a smoother control system with larger thresholds
-                # and more emphasis on going straight when possible
-                
                 # Log the error and output for debugging
                 if frames_processed % 20 == 0:  # Only log occasionally
                     log_message(f"Line error: {error}, PID output: {output:.2f}", throttle_key="pid_values")
@@ -735,29 +902,7 @@ def line_detection_thread():
                 elif error < 0:
                     last_direction = "right"
                 
-                # Implement a state machine for smoother motion:
-                # 1. If we're close to centered, go straight
-                # 2. For small-medium errors, use gentle turns
-                # 3. Only use sharp turns for large errors
-                
-                if abs(error) < 30:  # Very small error - go straight
-                    move_forward()
-                elif abs(error) < 80:  # Small-medium error - gentle correction
-                    if error > 0:
-                        left_forward()
-                    else:
-                        right_forward()
-                else:  # Large error - stronger correction but not full turn
-                    if error > 0:
-                        if error > 150:  # Extreme error - use full turn
-                            turn_left()
-                        else:
-                            left_forward()
-                    else:
-                        if error < -150:  # Extreme error - use full turn
-                            turn_right()
-                        else:
-                            right_forward()
+                STEERING_ACTIONS[steering_state]()
             else:
                 # No line detected
                 if line_detected:
@@ -770,133 +915,69 @@ def line_detection_thread():
                 # Try to recover the line with a smarter strategy:
                 # 1. First, use recent memory to keep going in the same direction
                 # 2. If that fails, implement a more robust search pattern
-                
-                # Check if we still have a recent memory of line position
-                if last_line_pos is not None and (time.time() - last_line_time) <= line_memory_timeout:
-                    # We have a recent memory - continue in the same direction
-                    log_message(f"Using memory to continue: {time.time() - last_line_time:.1f}s ago", 
-                              throttle_key="line_memory")
-                    
-                    # Determine which side of the frame the line was last seen
-                    frame_center = binary.shape[1] // 2
-                    
-                    # Bias the movement based on where the line was last seen
-                    if last_line_pos < frame_center - 50:
-                        # Line was on the left side
-                        left_forward()
-                    elif last_line_pos > frame_center + 50:
-                        # Line was on the right side
-                        right_forward()
-                    else:
-                        # Line was near center
-                        move_forward()
-                    
-                elif line_lost_counter >= max_line_lost_count:
-                    # We've lost the line for many frames - implement a search pattern
+                memory_valid = last_line_pos is not None and (now - last_line_time) <= line_memory_timeout
+                if not memory_valid and line_lost_counter >= max_line_lost_count:
                     line_lost_counter = max_line_lost_count  # Cap the counter
-                    
-                    # Use our last known direction to help with the search
-                    if last_direction == "left":
-                        log_message("Line search: sweeping right to find line", throttle_key="line_search")
-                        right_forward()
-                    elif last_direction == "right":
-                        log_message("Line search: sweeping left to find line", throttle_key="line_search")
-                        left_forward()
-                    else:
-                        # If we're truly lost, do a slow 360 scan
-                        if line_lost_counter % 40 < 20:  # Alternate direction every 20 frames
-                            log_message("Line search: slow right turn", throttle_key="line_search_rotate")
-                            # Slow rotation for searching
-                            with motor_lock:
-                                # Stop other motors
-                                set_pin(FL_IN1, 0)
-                                set_pin(FL_IN2, 0)
-                                set_pin(BL_IN1, 0)
-                                set_pin(BL_IN2, 0)
-                                # Just power right motors
-                                set_pin(FR_IN1, 0)
-                                set_pin(FR_IN2, 1)
-                                set_pin(BR_IN1, 0)
-                                set_pin(BR_IN2, 1)
-                                current_motor_state = "search_right"
-                        else:
-                            log_message("Line search: slow left turn", throttle_key="line_search_rotate")
-                            # Slow rotation for searching
-                            with motor_lock:
-                                # Stop right motors
-                                set_pin(FR_IN1, 0)
-                                set_pin(FR_IN2, 0)
-                                set_pin(BR_IN1, 0)
-                                set_pin(BR_IN2, 0)
-                                # Just power left motors
-                                set_pin(FL_IN1, 0)
-                                set_pin(FL_IN2, 1)
-                                set_pin(BL_IN1, 0)
-                                set_pin(BL_IN2, 1)
-                                current_motor_state = "search_left"
+                
+                # Report a new strategy right away, then at most every min_log_interval
+                recovery = recovery_state(memory_valid)
+                verbose = recovery != last_recovery or now - last_recovery_log >= min_log_interval
+                if verbose:
+                    last_recovery = recovery
+                    last_recovery_log = now
+                RECOVERY_ACTIONS[recovery](FRAME_CENTER, now, verbose)
+                
+                # Motor state-based delay for whatever the recovery chose; a brief
+                # loss gets one fixed delay so the robot keeps moving toward the line
+                if recovery == RECOVER_BRIEF:
+                    target_delay = BRIEF_LOSS_DELAY
                 else:
-                    # We've only lost the line briefly, continue in the last direction
-                    log_message(f"Brief line loss, continuing in last direction: {last_direction}", 
-                              throttle_key="brief_line_loss")
-                    
-                    if last_direction == "left":
-                        left_forward()
-                    elif last_direction == "right":
-                        right_forward()
-                    else:
-                        move_forward()
-                        
-                    # Sleep a bit longer to give more time for recovery
-                    time.sleep(0.05)  # Additional delay
+                    target_delay = DELAY_BY_STATE.get(current_motor_state, DEFAULT_LOOP_DELAY)
             
             # Add a brief pause to allow the robot to move between readings
             # This helps create smoother movement by not constantly changing directions
-            processing_time = time.time() - loop_start
-            
-            # Add a motor state-based delay:
-            # - Longer delay when going straight (let it move forward)
-            # - Shorter delay during turns (more responsive corrections)
-            if current_motor_state == "forward":
-                target_delay = 0.08  # Longer delay when going straight
-            elif current_motor_state in ["left", "right"]:
-                target_delay = 0.03  # Shorter delay during sharp turns
-            else:
-                target_delay = 0.05  # Medium delay for other states
-                
-            sleep_time = max(0.01, target_delay - processing_time)
-            time.sleep(sleep_time)
+            # Wait out the rest of the target delay measured from the loop start,
+            # but always give the robot at least MIN_LOOP_PAUSE to move
+            sleep_until(max(loop_start + target_delay, time.monotonic() + MIN_LOOP_PAUSE))
     
     except Exception as e:
         log_message(f"Error in line detection thread: {e}", "ERROR")
     finally:
-        # Release the camera
+        # Stop the capture thread before releasing the camera it reads from
+        capture_stop.set()
+        capture_thread.join(timeout=1.0)
         if camera is not None:
             camera.release()
         log_message("Line detection stopped")
 
 def signal_handler(sig, frame):
-    """Handle Ctrl+C and other signals for graceful shutdown."""
+    """Handle Ctrl+C and other signals by waking the main thread to shut down."""
     global running
     
-    log_message("\nShutting down...", "INFO")
     running = False  # Stop threads
-    time.sleep(1)  # Allow threads to exit
+    shutdown_event.set()
+
+def shutdown():
+    """Stop the motors and release hardware once the threads have been told to stop."""
+    log_message("\nShutting down...", "INFO")
+    
+    # Allow the line thread up to 1s to exit, in short slices so we move on as
+    # soon as it is done and a second signal isn't stuck behind one long sleep
+    for _ in range(20):
+        if line_thread is None or not line_thread.is_alive():
+            break
+        time.sleep(0.05)
     stop()  # Stop motors
     
     # Clean up resources
     cleanup_gpio()
     
-    if front_trigger is not None:
-        front_trigger.close()
-    if front_echo is not None:
-        front_echo.close()
-    if rear_trigger is not None:
-        rear_trigger.close()
-    if rear_echo is not None:
-        rear_echo.close()
+    if front_sensor is not None:
+        front_sensor.close()
+    if rear_sensor is not None:
+        rear_sensor.close()
     
     log_message("Shutdown complete")
-    sys.exit(0)
 
 if __name__ == "__main__":
     # Register signal handler for clean shutdown
@@ -922,17 +1003,13 @@ if __name__ == "__main__":
         log_message("- Press Ctrl+C to stop the robot")
         log_message("=" * 50 + "\n")
         
-        # Start ultrasonic sensor thread
-        distance_thread = threading.Thread(target=distance_sensor_thread, daemon=True)
-        distance_thread.start()
-        
         # Start line detection thread
         line_thread = threading.Thread(target=line_detection_thread, daemon=True)
         line_thread.start()
         
-        # Keep main thread alive
-        while running:
-            time.sleep(0.1)
+        # Block until a signal requests shutdown - no periodic wake-ups
+        shutdown_event.wait()
+        shutdown()
         
     except Exception as e:
         log_message(f"Error in main thread: {e}", "ERROR")